@@ -1,12 +1,41 @@
-import requests, pandas as pd, time, os, json
+import asyncio, aiohttp, orjson, csv, time, os, json, signal, shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from aiolimiter import AsyncLimiter
 
 BASE_URL = "https://api.nsf.gov/services/v1/awards.json"
 OUTPUT_FILE = "nsf_awards_us_2019_2024.csv"
-CHECKPOINT_FILE = "checkpoint.json"
-RPP = 25
-PAUSE = 0.2
+PARQUET_FILE = "nsf_awards_us_2019_2024.parquet"   # columnar copy of OUTPUT_FILE
+YEAR_FILE = "nsf_awards_{year}.csv"             # per-year parts, merged into OUTPUT_FILE
+YEAR_CHECKPOINT_FILE = "checkpoint_{year}.json"
+CHECKPOINT_FILE = "checkpoint.json"   # get_more_data.py's state for OUTPUT_FILE,
+SEEN_FILE = "seen_ids.txt"            # stale once OUTPUT_FILE is rebuilt here
+CHECKPOINT_VERSION = 1   # bump when the checkpoint fields change meaning
+RPP = 25               # documented page size; probe_rpp() raises it if the API honors more
+RPP_MAX = 100
 MAX_RETRIES = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}   # anything else is not worth retrying
+BACKOFF = 2                                  # seconds, doubled per attempt
 TIMEOUT = 40
+try:
+    import brotli  # noqa: F401 -- lets aiohttp decode "br" bodies
+    ACCEPT_ENCODING = "br, gzip"
+except ImportError:
+    ACCEPT_ENCODING = "gzip"
+HEADERS = {"Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"}
+
+# ---- CONCURRENCY ----
+CONCURRENCY = 32       # pages in flight at once, across all years
+LIMIT = 64             # total pooled connections
+LIMIT_PER_HOST = 16    # connections to api.nsf.gov
+TTL_DNS_CACHE = 300    # seconds to reuse the resolved API address
+KEEPALIVE = 60         # seconds an idle pooled connection is kept (aiohttp default: 15)
+CHECKPOINT_EVERY = 10  # pages between CSV flush + checkpoint
+WRITE_BUFFER = 1 << 20 # CSV rows are batched into ~1 MiB write() calls
+MAX_RATE = 10          # requests per second to api.nsf.gov (token bucket)
+
+limiter = AsyncLimiter(MAX_RATE, 1)
+shutdown_flag = asyncio.Event()   # set by the first Ctrl-C: finish in-flight pages, checkpoint, stop
 
 # ---- YEAR RANGE (go backwards) ----
 YEAR_START = 2019
@@ -27,32 +56,69 @@ PRINT_FIELDS = ",".join([
     "title",
     "abstractText"
 ])
+FIELDS = PRINT_FIELDS.split(",")
 
 def reset_files():
-    """Delete CSV and checkpoint if RESET=True."""
+    """Delete CSVs, the Parquet copy and checkpoints (ours and get_more_data.py's) if RESET=True."""
     if RESET:
-        if os.path.exists(OUTPUT_FILE):
-            os.remove(OUTPUT_FILE)
-            print(f"🗑️ Deleted old file: {OUTPUT_FILE}")
-        if os.path.exists(CHECKPOINT_FILE):
-            os.remove(CHECKPOINT_FILE)
-            print(f"🗑️ Deleted old checkpoint: {CHECKPOINT_FILE}")
-
-def load_checkpoint():
-    if os.path.exists(CHECKPOINT_FILE):
-        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+        for y in range(YEAR_START, YEAR_END + 1):
+            for path in (YEAR_FILE.format(year=y), YEAR_CHECKPOINT_FILE.format(year=y)):
+                if os.path.exists(path):
+                    os.remove(path)
+                    print(f"🗑️ Deleted old file: {path}")
+        for path in (OUTPUT_FILE, PARQUET_FILE, CHECKPOINT_FILE, SEEN_FILE):
+            if os.path.exists(path):
+                os.remove(path)
+                print(f"🗑️ Deleted old file: {path}")
+
+def check_version(state, path):
+    """Older checkpoints carry no version but have the same fields as version 1."""
+    version = state.get("version", 1)
+    if version != CHECKPOINT_VERSION:
+        raise SystemExit(f"❌ {path} is checkpoint version {version}, this script writes {CHECKPOINT_VERSION}.")
+
+def load_checkpoint(y):
+    path = YEAR_CHECKPOINT_FILE.format(year=y)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
             state = json.load(f)
-        if state.get("year", YEAR_END) > YEAR_END or state["year"] < YEAR_START:
-            state["year"] = YEAR_END
-            state["offset"] = 1
+        check_version(state, path)
         return state
-    return {"year": YEAR_END, "offset": 1, "written_header": False, "total_saved": 0}
+    return {"year": y, "offset": 1, "written_header": False, "total_saved": 0, "done": False, "csv_pos": 0}
 
 def save_checkpoint(state):
-    with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f)
+    """Write the checkpoint atomically: temp file, fsync, then rename over the old one."""
+    path = YEAR_CHECKPOINT_FILE.format(year=state["year"])
+    tmp = path + ".new"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**state, "version": CHECKPOINT_VERSION, "ts": time.time()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def checkpoint(state, fh):
+    """Push the CSV to disk first, so the checkpoint never points past saved rows, and record where it ends."""
+    fh.flush()
+    os.fsync(fh.fileno())
+    state["csv_pos"] = fh.tell()
+    save_checkpoint(state)
 
-def fetch_page(y, offset):
+def truncate_to_checkpoint(path, state):
+    """Drop rows written after the last checkpoint (flushed early by the buffer, or torn by a crash);
+    the resume fetches those pages again. Checkpoints from before `csv_pos` existed are left alone."""
+    pos = state.get("csv_pos")
+    if pos is not None and os.path.exists(path) and os.path.getsize(path) > pos:
+        os.truncate(path, pos)
+        print(f"✂️ Trimmed {path} back to its checkpoint ({pos} bytes).")
+
+def retry_after(e):
+    """Seconds the server asked us to wait (Retry-After on 429/503), or None."""
+    value = (e.headers or {}).get("Retry-After") if isinstance(e, aiohttp.ClientResponseError) else None
+    return float(value) if value and value.isdigit() else None
+
+async def fetch_page(session, sem, y, offset, give_up="a rerun will retry it"):
+    """Fetch one page of results from NSF API; returns its `response` object, or None if it was not fetched
+    (retries exhausted or Ctrl-C) -- the writer stops at that gap so a rerun fetches the page again."""
     params = {
         "rpp": RPP,
         "offset": offset,
@@ -63,77 +129,231 @@ def fetch_page(y, offset):
         "printFields": PRINT_FIELDS
     }
     for attempt in range(1, MAX_RETRIES + 1):
+        if shutdown_flag.is_set():   # don't queue for a rate-limit token just to give up
+            return None
         try:
-            r = requests.get(BASE_URL, params=params, timeout=TIMEOUT)
-            r.raise_for_status()
-            data = r.json()
-            return data.get("response", {}).get("award", [])
+            async with sem, limiter:
+                if shutdown_flag.is_set():
+                    return None
+                async with session.get(BASE_URL, params=params, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as r:
+                    r.raise_for_status()
+                    data = orjson.loads(await r.read())
+            return data.get("response", {})
         except Exception as e:
             print(f"⚠️  [Year {y} offset {offset} attempt {attempt}] {e}")
-            time.sleep(2 * attempt)
-    print(f"❌  Skipping [Year {y} offset {offset}] after {MAX_RETRIES} retries.")
-    return []
+            if attempt == MAX_RETRIES or (isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES):
+                break
+            await asyncio.sleep(retry_after(e) or BACKOFF * 2 ** (attempt - 1))
+    print(f"❌  Giving up on [Year {y} offset {offset}] after {attempt} attempt(s); {give_up}.")
+    return None
+
+def request_shutdown(loop):
+    """First Ctrl-C: stop scheduling pages, let in-flight ones land, checkpoint. A second Ctrl-C aborts.
+    A plain signal.signal() handler (not loop.add_signal_handler) so it also works on Windows."""
+    print("\n⏸️ Stopping after in-flight pages (Ctrl-C again to abort)...")
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    loop.call_soon_threadsafe(shutdown_flag.set)
 
-def append_chunk(df, state):
-    write_header = not state["written_header"]
-    df.to_csv(OUTPUT_FILE, mode="a", index=False, header=write_header, encoding="utf-8")
+def awards_of(page):
+    """The page's awards, trimmed to FIELDS (missing keys become None -> empty cells)."""
+    return [{k: a.get(k) for k in FIELDS} for a in page.get("award", [])]
+
+async def probe_rpp(session, sem):
+    """Ask for RPP_MAX rows once and keep that page size only if the API returns all of them --
+    a server capping pages anywhere below RPP_MAX would otherwise leave gaps between the offsets."""
+    global RPP
+    default, RPP = RPP, RPP_MAX
+    page = await fetch_page(session, sem, YEAR_START, 1, give_up=f"keeping page size {default}")
+    returned = len((page or {}).get("award", []))
+    RPP = RPP_MAX if returned == RPP_MAX else default
+    print(f"📏 Page size: {RPP} (probe returned {returned} of {RPP_MAX})")
+
+async def fetch_year(session, sem, queue, y, offset):
+    """Fetch every page of year `y` from `offset` on and return whether none were missed, pushing (y, offset, awards) onto `queue`."""
+    first = await fetch_page(session, sem, y, offset)
+    if first is None:
+        return False
+    awards = awards_of(first)
+    await queue.put((y, offset, awards))
+
+    total = int(first.get("metadata", {}).get("totalCount", 0) or 0)
+    if total:
+        async def fetch_into_queue(off):
+            page = await fetch_page(session, sem, y, off)
+            if page is None:   # failed or skipped after Ctrl-C -> leaves a gap the writer stops at
+                return False
+            await queue.put((y, off, awards_of(page)))
+            return True
+
+        return all(await asyncio.gather(*(fetch_into_queue(off) for off in range(offset + RPP, total + 1, RPP))))
+
+    # no total reported -> fetch windows of pages until one comes back short
+    count = len(awards)
+    missed = False
+    while count == RPP and not shutdown_flag.is_set():
+        offsets = [offset + RPP * i for i in range(1, CONCURRENCY + 1)]
+        pages = await asyncio.gather(*(fetch_page(session, sem, y, off) for off in offsets))
+        for off, page in zip(offsets, pages):
+            if page is not None:
+                await queue.put((y, off, awards_of(page)))
+        missed = None in pages
+        count = min(len((page or {}).get("award", [])) for page in pages)
+        offset = offsets[-1]
+    return count < RPP and not missed
+
+def append_chunk(writer, awards, state):
+    if not state["written_header"]:
+        writer.writeheader()
+    writer.writerows(awards)
     state["written_header"] = True
-    state["total_saved"] += len(df)
+    state["total_saved"] += len(awards)
 
-def main():
-    print("🚀 NSF Awards (2024 → 2019, NSF, US only)")
-    print(f"Fields: {PRINT_FIELDS}")
+def csv_fieldnames(path):
+    """Reuse the header of an existing CSV so appended rows line up with it."""
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, newline="", encoding="utf-8") as f:
+            return next(csv.reader(f))
+    return FIELDS
 
-    # Reset if needed
-    reset_files()
+def write_parquet():
+    """Rewrite PARQUET_FILE from OUTPUT_FILE (all columns as strings, zstd-compressed); returns whether it wrote one."""
+    if not os.path.exists(OUTPUT_FILE) or not os.path.getsize(OUTPUT_FILE):
+        return False   # nothing saved -> no header for pyarrow to read
+    import pyarrow as pa, pyarrow.csv as pacsv, pyarrow.parquet as pq   # optional, only needed for the Parquet copy
+    table = pacsv.read_csv(
+        OUTPUT_FILE,
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(column_types={c: pa.string() for c in csv_fieldnames(OUTPUT_FILE)}),
+    )
+    pq.write_table(table, PARQUET_FILE, compression="zstd")
+    return True
 
-    # Load or initialize checkpoint
-    state = load_checkpoint()
-    print(f"🔁 Starting from year {state['year']} offset {state['offset']} (saved so far: {state['total_saved']})")
+def save_pages(pages, state, fh, writer):
+    """Disk side of write_pages: append consecutive pages and advance the checkpoint position."""
+    for awards in pages:
+        if awards:
+            append_chunk(writer, awards, state)
+            print(f"   ✓ [{state['year']}] Saved {len(awards)} (total: {state['total_saved']})")
+        state["offset"] += RPP
+        if (state["offset"] - 1) // RPP % CHECKPOINT_EVERY == 0:
+            checkpoint(state, fh)
 
-    y = state["year"]
-    start_ts = time.time()
+async def write_pages(queue, outs, disk):
+    """Single writer for every year: hand each year's pages to the `disk` thread in offset order."""
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        y, offset, awards = item
+        out = outs[y]
+        if offset is None:
+            # end-of-year marker (y, None, complete): all of fetch_year(y)'s pages are queued ahead of it
+            if awards:
+                print(f"✅ Finished year {y}.")
+                out["state"]["done"] = True
+            elif not shutdown_flag.is_set():
+                print(f"⚠️ Year {y} stopped at offset {out['next']} after a failed page — run again to retry.")
+            await loop.run_in_executor(disk, checkpoint, out["state"], out["fh"])
+            continue
+        out["pending"][offset] = awards
+        ready = []
+        while out["next"] in out["pending"]:
+            ready.append(out["pending"].pop(out["next"]))
+            out["next"] += RPP
+        if ready:
+            await loop.run_in_executor(disk, save_pages, ready, out["state"], out["fh"], out["writer"])
 
-    while y >= YEAR_START:
-        offset = max(state["offset"], 1)
+async def scrape_years(session, sem, years, outs, disk):
+    """Run one fetch_year task per year against the shared session and semaphore, feeding one writer."""
+    queue = asyncio.Queue()
+    consumer = asyncio.create_task(write_pages(queue, outs, disk))
+
+    async def scrape_year(y):
+        offset = outs[y]["next"]
         page = 1 + (offset - 1) // RPP
-        print(f"\n📆 Year {y} — offset {offset} (page {page})")
+        print(f"\n📆 Year {y} — offset {offset} (page {page}, saved so far: {outs[y]['state']['total_saved']})")
+        complete = await fetch_year(session, sem, queue, y, offset)
+        await queue.put((y, None, complete))
 
-        while True:
-            awards = fetch_page(y, offset)
-            if not awards:
-                print(f"✅ Finished year {y}.")
-                y -= 1
-                state["year"] = y
-                state["offset"] = 1
-                save_checkpoint(state)
-                break
+    await asyncio.gather(*(scrape_year(y) for y in years))
+    await queue.put(None)
+    await consumer
+
+def merge_years(years):
+    """Concatenate the per-year CSVs (in `years` order) into OUTPUT_FILE under a single header."""
+    header_written = False
+    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as out:
+        for y in years:
+            path = YEAR_FILE.format(year=y)
+            if not os.path.exists(path) or not os.path.getsize(path):
+                continue
+            with open(path, newline="", encoding="utf-8") as f:
+                header = f.readline()
+                if not header_written:
+                    out.write(header)
+                    header_written = True
+                shutil.copyfileobj(f, out)
 
-            df = pd.DataFrame(awards)
-            append_chunk(df, state)
-            save_checkpoint(state)
+async def main():
+    print("🚀 NSF Awards (2024 → 2019, NSF, US only)")
+    print(f"Fields: {PRINT_FIELDS}")
+
+    # Reset if needed
+    reset_files()
+
+    years = list(range(YEAR_END, YEAR_START - 1, -1))
+    states = {y: load_checkpoint(y) for y in years}
+    for y in years:
+        if states[y]["done"]:
+            print(f"⏭️ Year {y} already done ({states[y]['total_saved']} saved).")
+    todo = [y for y in years if not states[y]["done"]]
+    start_ts = time.time()
 
-            count = len(df)
-            print(f"   ✓ Saved {count} (total: {state['total_saved']})")
+    connector = aiohttp.TCPConnector(limit=LIMIT, limit_per_host=LIMIT_PER_HOST,
+                                     keepalive_timeout=KEEPALIVE, ttl_dns_cache=TTL_DNS_CACHE)
+    sem = asyncio.Semaphore(CONCURRENCY)
+    with ExitStack() as stack:
+        outs = {}
+        for y in todo:
+            path = YEAR_FILE.format(year=y)
+            truncate_to_checkpoint(path, states[y])
+            fieldnames = csv_fieldnames(path)
+            fh = stack.enter_context(open(path, "a", newline="", encoding="utf-8", buffering=WRITE_BUFFER))
+            states[y]["offset"] = max(states[y]["offset"], 1)
+            outs[y] = {
+                "state": states[y],
+                "fh": fh,
+                "writer": csv.DictWriter(fh, fieldnames=fieldnames, extrasaction="ignore"),
+                "pending": {},
+                "next": states[y]["offset"],
+            }
+        # entered after the files, so it drains queued writes before they are closed
+        disk = stack.enter_context(ThreadPoolExecutor(max_workers=1))   # all file writes go through this one thread
 
-            if count < RPP:
-                print(f"🎯 End of results for year {y}.")
-                y -= 1
-                state["year"] = y
-                state["offset"] = 1
-                save_checkpoint(state)
-                break
+        async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+            loop = asyncio.get_running_loop()
+            signal.signal(signal.SIGINT, lambda signum, frame: request_shutdown(loop))
+            await probe_rpp(session, sem)
+            try:
+                await scrape_years(session, sem, todo, outs, disk)
+            finally:
+                # runs on Ctrl-C / errors too, so a restart resumes each year right after its last written page;
+                # queued behind any page the disk thread is still writing
+                for out in outs.values():
+                    disk.submit(checkpoint, out["state"], out["fh"]).result()
 
-            offset += RPP
-            state["offset"] = offset
-            save_checkpoint(state)
-            time.sleep(PAUSE)
+    if not all(state["done"] for state in states.values()):
+        print("\n⏸️ Stopped — run again to resume each year from its checkpoint.")
+        return
+    merge_years(years)
+    parquet = write_parquet()
 
     mins = (time.time() - start_ts) / 60.0
     print("\n🏁 Completed.")
-    print(f"💾 Total awards saved: {state['total_saved']}")
-    print(f"📄 File: {OUTPUT_FILE}")
+    print(f"💾 Total awards saved: {sum(state['total_saved'] for state in states.values())}")
+    print(f"📄 File: {OUTPUT_FILE}" + (f" (+ {PARQUET_FILE})" if parquet else ""))
     print(f"⏱️ Elapsed: {mins:.2f} min")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
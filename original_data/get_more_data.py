@@ -1,12 +1,38 @@
-import requests, pandas as pd, time, os, json, datetime
+import asyncio, aiohttp, orjson, pandas as pd, csv, time, os, json, signal, datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from aiolimiter import AsyncLimiter
 
 BASE_URL = "https://api.nsf.gov/services/v1/awards.json"
 OUTPUT_FILE = "nsf_awards_us_2019_2024.csv"
+PARQUET_FILE = "nsf_awards_us_2019_2024.parquet"   # columnar copy of OUTPUT_FILE
 CHECKPOINT_FILE = "checkpoint.json"
-RPP = 25
-PAUSE = 0.2
+CHECKPOINT_VERSION = 1   # bump when the checkpoint fields change meaning
+SEEN_FILE = "seen_ids.txt"   # one award id per line, mirrors the ids in OUTPUT_FILE
+RPP = 25               # documented page size; probe_rpp() raises it if the API honors more
+RPP_MAX = 100
 MAX_RETRIES = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}   # anything else is not worth retrying
+BACKOFF = 2                                  # seconds, doubled per attempt
 TIMEOUT = 40
+try:
+    import brotli  # noqa: F401 -- lets aiohttp decode "br" bodies
+    ACCEPT_ENCODING = "br, gzip"
+except ImportError:
+    ACCEPT_ENCODING = "gzip"
+HEADERS = {"Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"}
+
+# ---- CONCURRENCY ----
+CONCURRENCY = 16       # pages in flight at once
+LIMIT = 64             # total pooled connections
+LIMIT_PER_HOST = 16    # connections to api.nsf.gov
+KEEPALIVE = 60         # seconds an idle pooled connection is kept (aiohttp default: 15)
+CHECKPOINT_EVERY = 10  # pages between CSV flush + checkpoint
+WRITE_BUFFER = 1 << 20 # CSV rows are batched into ~1 MiB write() calls
+MAX_RATE = 10          # requests per second to api.nsf.gov (token bucket)
+
+limiter = AsyncLimiter(MAX_RATE, 1)
+shutdown_flag = asyncio.Event()   # set by the first Ctrl-C: finish in-flight pages, checkpoint, stop
 
 # ---- YEAR RANGE ----
 YEAR_START = 2020
@@ -15,6 +41,8 @@ YEAR_END = CURRENT_YEAR
 
 # ✅ Do NOT reset (we're continuing!)
 RESET = False
+# Rebuild PARQUET_FILE after each update? It re-reads the whole CSV, so it is off by default.
+WRITE_PARQUET = False
 
 # --- Fields you want ---
 PRINT_FIELDS = ",".join([
@@ -30,35 +58,95 @@ PRINT_FIELDS = ",".join([
     "abstractText",
     "estimatedTotalAmt"       # <-- added
 ])
+FIELDS = PRINT_FIELDS.split(",")
 
 def reset_files():
-    """Delete CSV and checkpoint only if RESET=True."""
+    """Delete CSV, id list and checkpoint only if RESET=True."""
     if RESET:
         if os.path.exists(OUTPUT_FILE):
             os.remove(OUTPUT_FILE)
             print(f"🗑️ Deleted old file: {OUTPUT_FILE}")
+        if os.path.exists(SEEN_FILE):
+            os.remove(SEEN_FILE)
+            print(f"🗑️ Deleted old id list: {SEEN_FILE}")
         if os.path.exists(CHECKPOINT_FILE):
             os.remove(CHECKPOINT_FILE)
             print(f"🗑️ Deleted old checkpoint: {CHECKPOINT_FILE}")
 
+def check_version(state, path):
+    """Older checkpoints carry no version but have the same fields as version 1."""
+    version = state.get("version", 1)
+    if version != CHECKPOINT_VERSION:
+        raise SystemExit(f"❌ {path} is checkpoint version {version}, this script writes {CHECKPOINT_VERSION}.")
+
 def load_checkpoint():
     if os.path.exists(CHECKPOINT_FILE):
         with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
             state = json.load(f)
-        # keep year inside valid range
+        check_version(state, CHECKPOINT_FILE)
+        # keep year inside valid range; a fresh pass has nothing left over to trim,
+        # but SEEN_FILE still mirrors OUTPUT_FILE as long as the CSV keeps its checkpointed size
         if state.get("year", YEAR_END) > YEAR_END or state["year"] < YEAR_START:
             state["year"] = YEAR_END
             state["offset"] = 1
+            state["seen_csv_size"] = state.pop("csv_pos", None)
+            state.pop("seen_pos", None)
         return state
     # default starting state
     return {"year": YEAR_END, "offset": 1, "written_header": os.path.exists(OUTPUT_FILE), "total_saved": 0}
 
 def save_checkpoint(state):
-    with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f)
+    """Write the checkpoint atomically: temp file, fsync, then rename over the old one."""
+    tmp = CHECKPOINT_FILE + ".new"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({**state, "version": CHECKPOINT_VERSION, "ts": time.time()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, CHECKPOINT_FILE)
+
+def checkpoint(state, fh, seen_fh, unsaved_ids):
+    """Push the CSV rows to disk, then their ids, then the checkpoint -- so neither the id list
+    nor the checkpoint ever points past saved rows."""
+    fh.flush()
+    os.fsync(fh.fileno())
+    state["csv_pos"] = fh.tell()
+    state.pop("seen_csv_size", None)
+    if seen_fh is not None:   # None when the id list could not be built this run
+        seen_fh.write("".join(i + "\n" for i in unsaved_ids))
+        seen_fh.flush()
+        os.fsync(seen_fh.fileno())
+        state["seen_pos"] = seen_fh.tell()
+    else:
+        state.pop("seen_pos", None)
+    unsaved_ids.clear()
+    save_checkpoint(state)
+
+def truncate_to_checkpoint(state):
+    """Mid-run resume: drop rows and ids written after the last checkpoint (flushed early by the buffer,
+    or torn by a crash); the resume fetches those pages again. Fresh passes and checkpoints from before
+    the positions existed carry no positions and are left alone."""
+    if "csv_pos" not in state:
+        return
+    if not os.path.exists(OUTPUT_FILE) or os.path.getsize(OUTPUT_FILE) < state["csv_pos"]:
+        # OUTPUT_FILE was replaced since the checkpoint -> its positions describe another file
+        print(f"⚠️ {OUTPUT_FILE} is shorter than its checkpoint — not trimming it.")
+        state.pop("csv_pos")
+        state.pop("seen_pos", None)
+        return
+    for path, key in ((OUTPUT_FILE, "csv_pos"), (SEEN_FILE, "seen_pos")):
+        pos = state.get(key)
+        if pos is not None and os.path.exists(path) and os.path.getsize(path) > pos:
+            os.truncate(path, pos)
+            print(f"✂️ Trimmed {path} back to its checkpoint ({pos} bytes).")
+
+def retry_after(e):
+    """Seconds the server asked us to wait (Retry-After on 429/503), or None."""
+    value = (e.headers or {}).get("Retry-After") if isinstance(e, aiohttp.ClientResponseError) else None
+    return float(value) if value and value.isdigit() else None
 
-def fetch_page(y, offset):
-    """Fetch one page of results from NSF API."""
+async def fetch_page(session, sem, y, offset, give_up="a rerun will retry it"):
+    """Fetch one page of results from NSF API; returns its `response` object, or None if it was not fetched
+    (retries exhausted or Ctrl-C) -- the writer stops at that gap so a rerun fetches the page again."""
     params = {
         "rpp": RPP,
         "offset": offset,
@@ -70,42 +158,178 @@ def fetch_page(y, offset):
         "orderBy": "date:asc"   # ensures stable pagination
     }
     for attempt in range(1, MAX_RETRIES + 1):
+        if shutdown_flag.is_set():   # don't queue for a rate-limit token just to give up
+            return None
         try:
-            r = requests.get(BASE_URL, params=params, timeout=TIMEOUT)
-            r.raise_for_status()
-            data = r.json()
-            return data.get("response", {}).get("award", [])
+            async with sem, limiter:
+                if shutdown_flag.is_set():
+                    return None
+                async with session.get(BASE_URL, params=params, timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as r:
+                    r.raise_for_status()
+                    data = orjson.loads(await r.read())
+            return data.get("response", {})
         except Exception as e:
             print(f"⚠️  [Year {y} offset {offset} attempt {attempt}] {e}")
-            time.sleep(2 * attempt)
-    print(f"❌  Skipping [Year {y} offset {offset}] after {MAX_RETRIES} retries.")
-    return []
-
-def append_chunk(df, state, existing_ids):
-    """Append new records avoiding duplicates by ID."""
-    if "id" in df.columns:
-        df = df[~df["id"].isin(existing_ids)]
-    if df.empty:
+            if attempt == MAX_RETRIES or (isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES):
+                break
+            await asyncio.sleep(retry_after(e) or BACKOFF * 2 ** (attempt - 1))
+    print(f"❌  Giving up on [Year {y} offset {offset}] after {attempt} attempt(s); {give_up}.")
+    return None
+
+def request_shutdown(loop):
+    """First Ctrl-C: stop scheduling pages, let in-flight ones land, checkpoint. A second Ctrl-C aborts.
+    A plain signal.signal() handler (not loop.add_signal_handler) so it also works on Windows."""
+    print("\n⏸️ Stopping after in-flight pages (Ctrl-C again to abort)...")
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    loop.call_soon_threadsafe(shutdown_flag.set)
+
+def awards_of(page):
+    """The page's awards, trimmed to FIELDS (missing keys become None -> empty cells)."""
+    return [{k: a.get(k) for k in FIELDS} for a in page.get("award", [])]
+
+async def probe_rpp(session, sem):
+    """Ask for RPP_MAX rows once and keep that page size only if the API returns all of them --
+    a server capping pages anywhere below RPP_MAX would otherwise leave gaps between the offsets."""
+    global RPP
+    default, RPP = RPP, RPP_MAX
+    page = await fetch_page(session, sem, YEAR_START, 1, give_up=f"keeping page size {default}")
+    returned = len((page or {}).get("award", []))
+    RPP = RPP_MAX if returned == RPP_MAX else default
+    print(f"📏 Page size: {RPP} (probe returned {returned} of {RPP_MAX})")
+
+async def fetch_year(session, sem, queue, y, offset):
+    """Fetch every page of year `y` from `offset` on and return whether none were missed, pushing (offset, awards) onto `queue`."""
+    first = await fetch_page(session, sem, y, offset)
+    if first is None:
+        return False
+    awards = awards_of(first)
+    await queue.put((offset, awards))
+
+    total = int(first.get("metadata", {}).get("totalCount", 0) or 0)
+    if total:
+        async def fetch_into_queue(off):
+            page = await fetch_page(session, sem, y, off)
+            if page is None:   # failed or skipped after Ctrl-C -> leaves a gap the writer stops at
+                return False
+            await queue.put((off, awards_of(page)))
+            return True
+
+        return all(await asyncio.gather(*(fetch_into_queue(off) for off in range(offset + RPP, total + 1, RPP))))
+
+    # no total reported -> fetch windows of pages until one comes back short
+    count = len(awards)
+    missed = False
+    while count == RPP and not shutdown_flag.is_set():
+        offsets = [offset + RPP * i for i in range(1, CONCURRENCY + 1)]
+        pages = await asyncio.gather(*(fetch_page(session, sem, y, off) for off in offsets))
+        for off, page in zip(offsets, pages):
+            if page is not None:
+                await queue.put((off, awards_of(page)))
+        missed = None in pages
+        count = min(len((page or {}).get("award", [])) for page in pages)
+        offset = offsets[-1]
+    return count < RPP and not missed
+
+def append_chunk(writer, awards, state, existing_ids, unsaved_ids):
+    """Append new records avoiding duplicates by ID; their ids wait in `unsaved_ids` for the next checkpoint."""
+    awards = [a for a in awards if str(a.get("id")) not in existing_ids]
+    if not awards:
         return 0
 
-    write_header = not state["written_header"]
-    df.to_csv(OUTPUT_FILE, mode="a", index=False, header=write_header, encoding="utf-8")
+    if not state["written_header"]:
+        writer.writeheader()
+    writer.writerows(awards)
+    new_ids = [str(a["id"]) for a in awards if a.get("id")]
+    unsaved_ids.extend(new_ids)
+    existing_ids.update(new_ids)
     state["written_header"] = True
-    state["total_saved"] += len(df)
-    return len(df)
+    state["total_saved"] += len(awards)
+    return len(awards)
 
-def load_existing_ids():
-    """Load existing award IDs to avoid re-saving duplicates."""
+def csv_fieldnames():
+    """Reuse the header of an existing CSV so appended rows line up with it.
+    Refuses a header that lacks any of FIELDS (e.g. get_data.py's file has no id/estimatedTotalAmt),
+    since the DictWriter would silently drop those columns."""
+    if os.path.exists(OUTPUT_FILE) and os.path.getsize(OUTPUT_FILE):
+        with open(OUTPUT_FILE, newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f))
+        missing = [k for k in FIELDS if k not in header]
+        if missing:
+            raise SystemExit(f"❌ {OUTPUT_FILE} has no column(s) {', '.join(missing)}; "
+                             f"point OUTPUT_FILE at a new file or set RESET = True.")
+        return header
+    return FIELDS
+
+def write_parquet():
+    """Rewrite PARQUET_FILE from OUTPUT_FILE (all columns as strings, zstd-compressed); returns whether it wrote one."""
+    if not os.path.exists(OUTPUT_FILE) or not os.path.getsize(OUTPUT_FILE):
+        return False   # nothing saved -> no header for pyarrow to read
+    import pyarrow as pa, pyarrow.csv as pacsv, pyarrow.parquet as pq   # optional, only needed for the Parquet copy
+    table = pacsv.read_csv(
+        OUTPUT_FILE,
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(column_types={c: pa.string() for c in csv_fieldnames()}),
+    )
+    pq.write_table(table, PARQUET_FILE, compression="zstd")
+    return True
+
+def load_existing_ids(state):
+    """Load existing award IDs to avoid re-saving duplicates; None if they could not be read.
+    SEEN_FILE is trusted only while OUTPUT_FILE has the size the last checkpoint saw, else it is rebuilt."""
     if not os.path.exists(OUTPUT_FILE):
+        if os.path.exists(SEEN_FILE):
+            os.remove(SEEN_FILE)   # lists rows that are gone
         return set()
+    synced = state.get("csv_pos", state.get("seen_csv_size"))
+    if os.path.exists(SEEN_FILE) and synced == os.path.getsize(OUTPUT_FILE):
+        with open(SEEN_FILE, "r", encoding="utf-8") as f:
+            return set(f.read().split())
+    # no id list, or it doesn't match OUTPUT_FILE -> build it again, from the Parquet copy if it is up to date
     try:
-        existing = pd.read_csv(OUTPUT_FILE, usecols=["id"])
-        return set(existing["id"].dropna().astype(str))
+        if os.path.exists(PARQUET_FILE) and os.path.getmtime(PARQUET_FILE) >= os.path.getmtime(OUTPUT_FILE):
+            import pyarrow.parquet as pq
+            ids = set(pq.read_table(PARQUET_FILE, columns=["id"])["id"].drop_null().to_pylist())
+        else:
+            existing = pd.read_csv(OUTPUT_FILE, usecols=["id"], dtype=str)
+            ids = set(existing["id"].dropna())
     except Exception:
         print("⚠️ Could not load existing IDs — continuing without duplicate filter.")
-        return set()
+        if os.path.exists(SEEN_FILE):
+            os.remove(SEEN_FILE)   # a partial list would be trusted by later runs
+        return None
+    with open(SEEN_FILE, "w", encoding="utf-8") as f:
+        f.write("".join(i + "\n" for i in ids))
+    return ids
 
-def main():
+def save_pages(pages, state, fh, writer, seen_fh, existing_ids, unsaved_ids):
+    """Disk side of write_pages: append consecutive pages and advance the checkpoint position."""
+    for awards in pages:
+        if awards:
+            added = append_chunk(writer, awards, state, existing_ids, unsaved_ids)
+            print(f"   ✓ Fetched {len(awards)}, saved {added} new (total: {state['total_saved']})")
+        state["offset"] += RPP
+        if (state["offset"] - 1) // RPP % CHECKPOINT_EVERY == 0:
+            checkpoint(state, fh, seen_fh, unsaved_ids)
+
+async def write_pages(queue, state, fh, writer, seen_fh, existing_ids, unsaved_ids, disk):
+    """Single consumer: hand pages to the `disk` thread in offset order, so fetching carries on while rows are written."""
+    loop = asyncio.get_running_loop()
+    pending = {}
+    next_offset = state["offset"]
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        offset, awards = item
+        pending[offset] = awards
+        ready = []
+        while next_offset in pending:
+            ready.append(pending.pop(next_offset))
+            next_offset += RPP
+        if ready:
+            await loop.run_in_executor(disk, save_pages, ready, state, fh, writer, seen_fh, existing_ids, unsaved_ids)
+
+async def main():
     print("🚀 Updating NSF Awards (continue → today)")
     print(f"Fields: {PRINT_FIELDS}")
 
@@ -114,52 +338,63 @@ def main():
     state = load_checkpoint()
     print(f"🔁 Resuming from year {state['year']} offset {state['offset']} (saved so far: {state['total_saved']})")
 
-    existing_ids = load_existing_ids()
+    fieldnames = csv_fieldnames()   # fails before any work if OUTPUT_FILE can't take these rows
+    truncate_to_checkpoint(state)
+    existing_ids = load_existing_ids(state)
+    track_seen = existing_ids is not None   # without the old ids, SEEN_FILE would only list this run's
+    existing_ids = existing_ids or set()
     print(f"🧮 Loaded {len(existing_ids)} existing award IDs.")
 
+    unsaved_ids = []   # ids of rows written since the last checkpoint; SEEN_FILE gets them once the rows are on disk
     y = state["year"]
     start_ts = time.time()
 
-    while y >= YEAR_START:
-        offset = max(state["offset"], 1)
-        page = 1 + (offset - 1) // RPP
-        print(f"\n📆 Year {y} — offset {offset} (page {page})")
-
-        while True:
-            awards = fetch_page(y, offset)
-            if not awards:
-                print(f"✅ Finished year {y}.")
-                y -= 1
-                state["year"] = y
-                state["offset"] = 1
-                save_checkpoint(state)
-                break
+    connector = aiohttp.TCPConnector(limit=LIMIT, limit_per_host=LIMIT_PER_HOST, keepalive_timeout=KEEPALIVE)
+    sem = asyncio.Semaphore(CONCURRENCY)
+    with open(OUTPUT_FILE, "a", newline="", encoding="utf-8", buffering=WRITE_BUFFER) as fh, \
+            (open(SEEN_FILE, "a", encoding="utf-8") if track_seen else nullcontext()) as seen_fh, \
+            ThreadPoolExecutor(max_workers=1) as disk:   # all file writes go through this one thread
+        writer = csv.DictWriter(fh, fieldnames=fieldnames, extrasaction="ignore")
+        async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+            loop = asyncio.get_running_loop()
+            signal.signal(signal.SIGINT, lambda signum, frame: request_shutdown(loop))
+            await probe_rpp(session, sem)
+            try:
+                while y >= YEAR_START and not shutdown_flag.is_set():
+                    offset = max(state["offset"], 1)
+                    state["offset"] = offset
+                    page = 1 + (offset - 1) // RPP
+                    print(f"\n📆 Year {y} — offset {offset} (page {page})")
 
-            df = pd.DataFrame(awards)
-            added = append_chunk(df, state, existing_ids)
-            save_checkpoint(state)
+                    queue = asyncio.Queue()
+                    consumer = asyncio.create_task(write_pages(queue, state, fh, writer, seen_fh, existing_ids, unsaved_ids, disk))
+                    complete = await fetch_year(session, sem, queue, y, offset)
+                    await queue.put(None)
+                    await consumer
+                    if not complete:
+                        # the single checkpoint can only point into one year, so stop at the gap
+                        break
 
-            count = len(df)
-            print(f"   ✓ Fetched {count}, saved {added} new (total: {state['total_saved']})")
-
-            if count < RPP:
-                print(f"🎯 End of results for year {y}.")
-                y -= 1
-                state["year"] = y
-                state["offset"] = 1
-                save_checkpoint(state)
-                break
+                    print(f"✅ Finished year {y}.")
+                    y -= 1
+                    state["year"] = y
+                    state["offset"] = 1
+                    disk.submit(checkpoint, state, fh, seen_fh, unsaved_ids).result()
+            finally:
+                # runs on Ctrl-C / errors too, so a restart resumes right after the last written page;
+                # queued behind any page the disk thread is still writing
+                disk.submit(checkpoint, state, fh, seen_fh, unsaved_ids).result()
 
-            offset += RPP
-            state["offset"] = offset
-            save_checkpoint(state)
-            time.sleep(PAUSE)
+    if y >= YEAR_START:
+        print(f"\n⏸️ Stopped at year {state['year']} offset {state['offset']} — run again to resume.")
+        return
+    parquet = WRITE_PARQUET and write_parquet()
 
     mins = (time.time() - start_ts) / 60.0
     print("\n🏁 Completed update.")
     print(f"💾 Total awards saved: {state['total_saved']}")
-    print(f"📄 File: {OUTPUT_FILE}")
+    print(f"📄 File: {OUTPUT_FILE}" + (f" (+ {PARQUET_FILE})" if parquet else ""))
     print(f"⏱️ Elapsed: {mins:.2f} min")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())